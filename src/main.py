@@ -12,7 +12,8 @@ import workstate.obstore
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
-from .restate_pydub import Executor, create_service
+from .restate_pydub import DecodedCache, Executor, create_service
+from .restate_pydub.obstore import StreamLoader, StreamPersister
 
 if TYPE_CHECKING:
     from obstore.store import ClientConfig
@@ -29,6 +30,16 @@ class Settings(BaseSettings):
 
     service_name: str = "Pydub"
 
+    max_workers: int | None = None
+
+    tmp_dir: str | None = None
+
+    decoded_cache_size: int = 0
+
+    decoded_cache_dir: str | None = None
+
+    ffmpeg_threads: int = 0
+
     identity_keys: list[str] = Field(alias="restate_identity_keys", default=[])
 
 
@@ -49,22 +60,39 @@ if settings.obstore.client_options:
 if settings.obstore.url:
     store = obstore.store.from_url(settings.obstore.url, client_options=client_options)
 
-loader = workstate.obstore.FileLoader(
+loader = StreamLoader(
+    workstate.obstore.FileLoader(
+        store,
+        client_options=client_options,
+        logger=structlog.get_logger("workstate"),
+    ),
     store,
     client_options=client_options,
-    logger=structlog.get_logger("workstate"),
 )
 
-persister = workstate.obstore.FilePersister(
+persister = StreamPersister(
+    workstate.obstore.FilePersister(
+        store,
+        client_options=client_options,
+        logger=structlog.get_logger("workstate"),
+    ),
     store,
     client_options=client_options,
-    logger=structlog.get_logger("workstate"),
 )
 
+cache: DecodedCache | None = None
+
+if settings.decoded_cache_size > 0:
+    cache = DecodedCache(settings.decoded_cache_size, dir=settings.decoded_cache_dir)
+
 executor = Executor(
     loader,
     persister,
     logger=structlog.get_logger("pydub"),
+    max_workers=settings.max_workers,
+    tmp_dir=settings.tmp_dir,
+    cache=cache,
+    threads=settings.ffmpeg_threads,
 )
 
 service = create_service(executor, service_name=settings.service_name)
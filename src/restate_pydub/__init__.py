@@ -1,4 +1,6 @@
 from .executor import (
+    BatchExportRequest,
+    DecodedCache,
     Executor,
     ExportRequest,
     SegmentRequest,
@@ -6,6 +8,8 @@ from .executor import (
 from .restate import create_service, register_service
 
 __all__ = [
+    "BatchExportRequest",
+    "DecodedCache",
     "Executor",
     "ExportRequest",
     "SegmentRequest",
@@ -1,14 +1,37 @@
+import fcntl
+import functools
+import hashlib
+import itertools
+import json
 import logging
+import mmap
+import os
+import shutil
+import struct
+import subprocess
 import tempfile
+import threading
 import typing
+from collections import OrderedDict
+from collections.abc import Buffer
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
 from pathlib import Path, PurePosixPath
-from typing import Protocol, Sequence
+from typing import BinaryIO, Callable, Iterable, Iterator, Protocol, Sequence
 
 from pydantic import AnyUrl, BaseModel, ConfigDict, Field
 from pydub import AudioSegment
+from pydub.exceptions import (
+    CouldntDecodeError,
+    CouldntEncodeError,
+    InvalidID3TagVersion,
+)
 
 _logger = logging.getLogger(__name__)
 
+_Logger = logging.Logger | logging.LoggerAdapter[logging.Logger]
+
 
 class Input(BaseModel):
     source: AnyUrl | PurePosixPath = Field(
@@ -54,6 +77,10 @@ class ExportOptions(BaseModel):
     )
 
 
+# Resolved export options along with the ffmpeg arguments encoding them
+_ExportArgs = tuple[ExportOptions, tuple[str, ...]]
+
+
 class Output(BaseModel):
     destination: AnyUrl | PurePosixPath = Field(
         description="The destination of the exported audio file",
@@ -117,10 +144,55 @@ class SegmentRequest(BaseModel):
     output: Output
 
 
+class BatchExportRequest(BaseModel):
+    model_config = ConfigDict(
+        json_schema_extra={
+            "examples": [
+                {
+                    "requests": [
+                        {
+                            "input": {
+                                "source": "s3://bucket/audio1.wav",
+                            },
+                            "output": {
+                                "destination": "s3://bucket/audio1.mp3",
+                            },
+                        },
+                        {
+                            "input": {
+                                "source": "s3://bucket/audio2.wav",
+                            },
+                            "output": {
+                                "destination": "s3://bucket/audio2.mp3",
+                            },
+                        },
+                    ],
+                },
+            ]
+        }
+    )
+
+    requests: Sequence[ExportRequest]
+
+
 class Loader(typing.Protocol):
     def load(self, ref: AnyUrl | PurePosixPath, dst: Path): ...
 
 
+@typing.runtime_checkable
+class StreamingLoader(Loader, Protocol):
+    def stream(self, ref: AnyUrl | PurePosixPath) -> Iterator[bytes]: ...
+
+
+@typing.runtime_checkable
+class BatchLoader(Loader, Protocol):
+    def load_many(
+        self,
+        refs: Sequence[AnyUrl | PurePosixPath],
+        dsts: Sequence[Path],
+    ): ...
+
+
 class Persister(Protocol):
     def persist(
         self,
@@ -129,16 +201,147 @@ class Persister(Protocol):
     ): ...
 
 
+@typing.runtime_checkable
+class StreamingPersister(Persister, Protocol):
+    def persist_stream(
+        self,
+        ref: AnyUrl | PurePosixPath,
+        chunks: Iterable[bytes],
+    ): ...
+
+
+@dataclass
+class _CacheEntry:
+    size: int
+    users: int = 0
+
+
+class DecodedCache:
+    """Local cache of sources decoded to PCM, keyed by their reference.
+
+    Sources are assumed to be immutable: a changed object under the same
+    reference keeps being served from the cache until it is evicted.
+    Least recently used entries are evicted once the cache grows over max_size
+    bytes (entries in use are never evicted).
+    """
+
+    def __init__(self, max_size: int, dir: str | None = None):
+        self.max_size = max_size
+
+        # Every cache owns a private directory, cleaned up with the cache,
+        # so that worker processes sharing a parent directory never evict
+        # each other's entries.
+        self._tmp_dir = tempfile.TemporaryDirectory(
+            prefix="pydub-decoded-",
+            dir=dir or _default_tmp_dir(reserve=max_size),
+        )
+        self.dir = Path(self._tmp_dir.name)
+
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._decoding: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(
+        self,
+        ref: AnyUrl | PurePosixPath,
+        decode: Callable[[Path], None],
+    ) -> Iterator[Path]:
+        """Yield the decoded source, calling decode to populate it on a miss."""
+
+        key = hashlib.blake2b(str(ref).encode()).hexdigest()
+        path = self.dir / f"{key}.wav"
+
+        entry = self._checkout(key) or self._populate(key, path, decode)
+
+        try:
+            yield path
+        finally:
+            with self._lock:
+                entry.users -= 1
+                self._evict()
+
+    def _checkout(self, key: str) -> _CacheEntry | None:
+        """Pin the entry of key, waiting for a decode of it in progress.
+
+        Returns None when the caller has to decode it.
+        """
+
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry:
+                    entry.users += 1
+                    self._entries.move_to_end(key)
+
+                    return entry
+
+                decoding = self._decoding.get(key)
+                if decoding is None:
+                    self._decoding[key] = threading.Event()
+
+                    return None
+
+            # A failed decode leaves no entry behind: the next caller retries it
+            decoding.wait()
+
+    def _populate(
+        self,
+        key: str,
+        path: Path,
+        decode: Callable[[Path], None],
+    ) -> _CacheEntry:
+        tmp = path.with_suffix(".tmp")
+
+        try:
+            decode(tmp)
+            os.replace(tmp, path)
+
+            with self._lock:
+                entry = self._entries[key] = _CacheEntry(
+                    size=path.stat().st_size, users=1
+                )
+
+            return entry
+        finally:
+            tmp.unlink(missing_ok=True)
+
+            with self._lock:
+                self._decoding.pop(key).set()
+
+    def _evict(self):
+        size = sum(entry.size for entry in self._entries.values())
+
+        for key, entry in list(self._entries.items()):
+            if size <= self.max_size:
+                break
+
+            if entry.users:
+                continue
+
+            (self.dir / f"{key}.wav").unlink(missing_ok=True)
+            del self._entries[key]
+            size -= entry.size
+
+
 class Executor:
     def __init__(
         self,
         loader: Loader,
         persister: Persister,
         logger: logging.Logger = _logger,
+        max_workers: int | None = None,
+        tmp_dir: str | None = None,
+        cache: DecodedCache | None = None,
+        threads: int = 0,
     ):
         self.loader = loader
         self.persister = persister
         self.logger = logger
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.tmp_dir = tmp_dir
+        self.cache = cache
+        self.threads = threads
 
     def export(self, request: ExportRequest):
         self.logger.info(
@@ -146,21 +349,131 @@ class Executor:
             extra={"source": request.input.source, "format": request.input.format},
         )
 
-        format = request.input.format
-        if not format:
-            format = _get_extension(request.input.source)
+        format = self._detect_input_format(request.input)
+
+        # The output format decides the export path, so resolve it only once
+        exportOptions = self._resolve_export_options(
+            request.output, request.output.destination
+        )
+        output = request.output.model_copy(update={"export": exportOptions})
 
+        # Remuxing needs the source as is, and pydub cannot read every decoded
+        # sample format (eg. floating point).
+        if (
+            self.cache
+            and not _can_copy(format, exportOptions)
+            and not _requires_pydub(exportOptions)
+        ):
+            with self._decoded(request.input, format) as source:
+                self._transcode(
+                    source,
+                    output.destination,
+                    self._compute_export_args(output, output.destination),
+                )
+
+            return
+
+        if isinstance(self.loader, StreamingLoader) and _can_stream(
+            format, exportOptions
+        ):
             self.logger.info(
-                "Detecting input format",
-                extra={"source": request.input.source, "format": format},
+                "Streaming audio source",
+                extra={"source": request.input.source},
+            )
+
+            self._transcode(
+                self.loader.stream(request.input.source),
+                output.destination,
+                self._compute_export_args(
+                    output, output.destination, source_format=format
+                ),
+                input_format=request.input.format,
+            )
+
+            return
+
+        with self._temporary_path() as sourceFile:
+            self.loader.load(request.input.source, sourceFile)
+
+            self._export_file(
+                sourceFile,
+                format,
+                output,
+                input_format=request.input.format,
             )
 
-        with tempfile.NamedTemporaryFile(delete=True) as sourceFile:
-            self.loader.load(request.input.source, Path(sourceFile.name))
+    def batch_export(self, request: BatchExportRequest):
+        self.logger.info(
+            "Exporting audio batch",
+            extra={"requests": len(request.requests)},
+        )
+
+        # With a cache, requests go through export one by one: fetching the batch
+        # up front would download (and decode) sources the cache already holds.
+        if self.cache or not isinstance(self.loader, BatchLoader):
+            self._run_concurrently(
+                [functools.partial(self.export, r) for r in request.requests]
+            )
+
+            return
+
+        self._batch_export(request.requests)
 
-            audio: AudioSegment = AudioSegment.from_file(sourceFile.name, format)
+    def _batch_export(self, requests: Sequence[ExportRequest]):
+        loader = self.loader
+        assert isinstance(loader, BatchLoader)
 
-            self._export(audio, request.output)
+        if not requests:
+            return
+
+        # Sources are fetched a window at a time, so that scratch space holds at
+        # most two windows however large the batch is: the next window is fetched
+        # while the current one is exported, so neither waits for the other.
+        windows = [
+            requests[i : i + self.max_workers]
+            for i in range(0, len(requests), self.max_workers)
+        ]
+
+        # The fetcher shuts down first, so a pending fetch is done with its
+        # files by the time they are removed.
+        with ExitStack() as scratch, ThreadPoolExecutor(max_workers=1) as fetcher:
+
+            def fetch(window: Sequence[ExportRequest]):
+                files = scratch.enter_context(ExitStack())
+                sources = [files.enter_context(self._temporary_path()) for _ in window]
+
+                # Fetch the window in one go to amortize object store latency
+                fetched = fetcher.submit(
+                    loader.load_many, [r.input.source for r in window], sources
+                )
+
+                return files, sources, fetched
+
+            pending = fetch(windows[0])
+
+            for i, window in enumerate(windows):
+                files, sources, fetched = pending
+                fetched.result()
+
+                if i + 1 < len(windows):
+                    pending = fetch(windows[i + 1])
+
+                with files:
+                    self._export_files(window, sources)
+
+    def _export_files(self, requests: Sequence[ExportRequest], sources: Sequence[Path]):
+        self._run_concurrently(
+            [
+                functools.partial(
+                    self._export_file,
+                    source,
+                    self._detect_input_format(exportRequest.input),
+                    exportRequest.output,
+                    input_format=exportRequest.input.format,
+                )
+                for source, exportRequest in zip(sources, requests, strict=True)
+            ]
+        )
 
     def segment(self, request: SegmentRequest):
         self.logger.info(
@@ -168,47 +481,435 @@ class Executor:
             extra={"source": request.input.source, "format": request.input.format},
         )
 
-        format = request.input.format
+        format = self._detect_input_format(request.input)
+
+        # Bind the request context once instead of repeating it for every segment
+        logger = logging.LoggerAdapter(
+            self.logger,
+            {"source": request.input.source},
+            merge_extra=True,
+        )
+
+        if self._can_copy_segments(format, request.segments, request.output):
+            logger.info("Cutting segments without re-encoding")
+
+            with self._temporary_path() as sourceFile:
+                self.loader.load(request.input.source, sourceFile)
+
+                self._segment_copy(
+                    sourceFile,
+                    format,
+                    request.segments,
+                    request.output,
+                    logger,
+                    input_format=request.input.format,
+                )
+
+            return
+
+        # Segments are cut from the decoded PCM by byte offset, so the source is
+        # only ever decoded once, however many segments are requested.
+        with self._decoded(request.input, format) as source:
+            self._segment_pcm(source, request.segments, request.output, logger)
+
+    def _detect_input_format(self, input: Input) -> str:
+        format = input.format
         if not format:
-            format = _get_extension(request.input.source)
+            format = _get_extension(input.source)
 
             self.logger.info(
                 "Detecting input format",
-                extra={"source": request.input.source, "format": format},
+                extra={"source": input.source, "format": format},
             )
 
-        with tempfile.NamedTemporaryFile(delete=True) as sourceFile:
-            self.loader.load(request.input.source, Path(sourceFile.name))
+        return format
+
+    @contextmanager
+    def _decoded(self, input: Input, format: str) -> Iterator[Path]:
+        """Yield the source decoded to PCM (from the cache, when there is one)."""
+
+        def decode(dst: Path):
+            self.logger.info(
+                "Decoding audio source",
+                extra={"source": input.source, "format": format},
+            )
 
-            audio: AudioSegment = AudioSegment.from_file(sourceFile.name, format)
+            if isinstance(self.loader, StreamingLoader) and _can_stream(format, None):
+                _ffmpeg_decode(self.loader.stream(input.source), dst, input.format)
 
-            for segment in request.segments:
-                start_ms = int(segment.start * 1000)
-                end_ms = int(segment.end * 1000)
+                return
 
-                audioSegment = audio[start_ms:end_ms]
+            with self._temporary_path() as sourceFile:
+                self.loader.load(input.source, sourceFile)
 
-                self.logger.info(
-                    "Exporting audio segment",
-                    extra=segment.model_dump(),
+                _ffmpeg_decode(sourceFile, dst, input.format)
+
+        if self.cache:
+            with self.cache.acquire(input.source, decode) as path:
+                yield path
+
+            return
+
+        with self._temporary_path() as decodedFile:
+            decode(decodedFile)
+
+            yield decodedFile
+
+    def _export_file(
+        self,
+        source: Path,
+        format: str,
+        output: Output,
+        input_format: str | None = None,
+    ):
+        exportOptions = self._resolve_export_options(output, output.destination)
+
+        if _requires_pydub(exportOptions):
+            audio: AudioSegment = AudioSegment.from_file(str(source), format)
+
+            self._export(audio, output.model_copy(update={"export": exportOptions}))
+
+            return
+
+        self._transcode(
+            source,
+            output.destination,
+            self._compute_export_args(output, output.destination, source_format=format),
+            input_format=input_format,
+        )
+
+    def _can_copy_segments(
+        self,
+        format: str,
+        segments: Sequence[Segment],
+        output: Output,
+    ) -> bool:
+        # Only formats made of self-contained frames come out of a cut right: other
+        # muxers copy the source's stream headers (eg. FLAC's STREAMINFO or Ogg's
+        # granule positions), which then describe the whole source.
+        if _demuxer(format) not in _COPY_SEGMENT_FORMATS:
+            return False
+
+        exportOptions = output.export or ExportOptions.model_construct()
+
+        exportFormats = (
+            {exportOptions.format}
+            if exportOptions.format
+            else {
+                _get_extension(segment.name) or _DEFAULT_FORMAT for segment in segments
+            }
+        )
+
+        return all(
+            not _requires_pydub(options) and _can_copy(format, options)
+            for options in (
+                exportOptions.model_copy(update={"format": exportFormat})
+                for exportFormat in exportFormats
+            )
+        )
+
+    def _segment_copy(
+        self,
+        source: Path,
+        source_format: str,
+        segments: Sequence[Segment],
+        output: Output,
+        logger: _Logger | None = None,
+        input_format: str | None = None,
+    ):
+        names = [segment.name for segment in segments]
+        destinations = _append_paths(output.destination, names)
+
+        def copy_args(destination: AnyUrl | PurePosixPath) -> _ExportArgs:
+            exportOptions, encodeArgs = self._compute_export_args(
+                output, destination, source_format=source_format
+            )
+
+            # Cuts rarely start on a packet with a zero timestamp
+            return exportOptions, (*encodeArgs, "-avoid_negative_ts", "make_zero")
+
+        exportArgs = self._segment_export_args(output, names, destinations, copy_args)
+
+        self._run_concurrently(
+            [
+                functools.partial(
+                    self._transcode,
+                    source,
+                    destination,
+                    args,
+                    input_format=input_format,
+                    input_args=("-ss", f"{segment.start}", "-to", f"{segment.end}"),
+                    segment=segment,
+                    logger=logger,
+                )
+                for segment, destination, args in zip(
+                    segments, destinations, exportArgs, strict=True
+                )
+            ]
+        )
+
+    def _segment_pcm(
+        self,
+        source: Path,
+        segments: Sequence[Segment],
+        output: Output,
+        logger: _Logger | None = None,
+    ):
+        with open(source, "rb") as file:
+            header = _read_wav_header(file)
+
+            offset = header.offset
+            rate = header.rate
+            channels = header.channels
+            frameSize = header.frame_size
+            frames = header.size // frameSize
+
+            with (
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+                memoryview(mapped) as pcm,
+            ):
+                # Segments are validated already: read their fields only once
+                names = [segment.name for segment in segments]
+                destinations = _append_paths(output.destination, names)
+
+                def pcm_args(destination: AnyUrl | PurePosixPath) -> _ExportArgs:
+                    exportOptions = self._resolve_export_options(output, destination)
+
+                    # Decoded sources are PCM already, which is what pydub
+                    # writes for raw and WAV exports (in its own sample width,
+                    # where ffmpeg defaults to 16 bits).
+                    pydubFormat = _PYDUB_FORMATS[header.format]
+
+                    if _requires_pydub(exportOptions):
+                        exportOptions = exportOptions.model_copy(
+                            update={"format": pydubFormat}
+                        )
+                    elif exportOptions.format == "wav" and not exportOptions.codec:
+                        exportOptions = exportOptions.model_copy(
+                            update={"codec": f"pcm_{pydubFormat}"}
+                        )
+
+                    return exportOptions, _encode_args(exportOptions, self.threads)
+
+                exportArgs = self._segment_export_args(
+                    output, names, destinations, pcm_args
                 )
 
-                self._export(audioSegment, request.output, segment.name)  # pyright: ignore[reportArgumentType]
+                tasks: list[Callable[[], None]] = []
+
+                for segment, destination, args in zip(
+                    segments, destinations, exportArgs, strict=True
+                ):
+                    start = (
+                        offset + min(round(segment.start * rate), frames) * frameSize
+                    )
+                    end = offset + min(round(segment.end * rate), frames) * frameSize
+
+                    tasks.append(
+                        functools.partial(
+                            self._transcode,
+                            _chunks(pcm[start:end]),
+                            destination,
+                            args,
+                            input_format=header.format,
+                            input_args=("-ar", f"{rate}", "-ac", f"{channels}"),
+                            segment=segment,
+                            logger=logger,
+                        )
+                    )
+
+                # Each segment is encoded by its own ffmpeg process,
+                # so segments are transcoded in parallel.
+                try:
+                    self._run_concurrently(tasks)
+                finally:
+                    # Pending slices of the mapping must go before it is closed
+                    tasks.clear()
+
+    def _segment_export_args(
+        self,
+        output: Output,
+        names: Sequence[str],
+        destinations: Sequence[AnyUrl | PurePosixPath],
+        compute: Callable[[AnyUrl | PurePosixPath], _ExportArgs],
+    ) -> list[_ExportArgs]:
+        # Export arguments only depend on the output format, which is the same
+        # for every segment unless it comes from their names.
+        exportArgs: dict[str, _ExportArgs] = {}
+        exportFormat = output.export.format if output.export else None
+
+        segmentArgs: list[_ExportArgs] = []
+
+        for name, destination in zip(names, destinations, strict=True):
+            # Destinations end with the segment name, so is their extension
+            format = exportFormat or _get_extension(name)
+            if format not in exportArgs:
+                exportArgs[format] = compute(destination)
+
+            segmentArgs.append(exportArgs[format])
+
+        return segmentArgs
+
+    def _run_concurrently(self, tasks: Sequence[Callable[[], None]]):
+        if not tasks:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tasks))) as pool:
+            futures = [pool.submit(task) for task in tasks]
+
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                pool.shutdown(cancel_futures=True)
+
+                raise
+
+    def _transcode(
+        self,
+        source: Path | Iterable[Buffer],
+        destination: AnyUrl | PurePosixPath,
+        export_args: _ExportArgs,
+        input_format: str | None = None,
+        input_args: Sequence[str] = (),
+        segment: Segment | None = None,
+        logger: _Logger | None = None,
+    ):
+        logger = logger or self.logger
+
+        if segment and logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Exporting audio segment",
+                extra={
+                    "segment": segment.name,
+                    "start": segment.start,
+                    "end": segment.end,
+                },
+            )
+
+        exportOptions, encodeArgs = export_args
+
+        if isinstance(self.persister, StreamingPersister) and _can_stream_output(
+            exportOptions
+        ):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Transcoding audio starts",
+                    extra={
+                        "destination": destination,
+                        "options": encodeArgs,
+                    },
+                )
+
+            self.persister.persist_stream(
+                destination,
+                _ffmpeg_stream(
+                    source,
+                    encodeArgs,
+                    input_format=input_format,
+                    input_args=input_args,
+                ),
+            )
+
+            logger.info(
+                "Transcoding audio completed",
+                extra={"destination": destination},
+            )
+
+            return
+
+        with self._temporary_path() as exportedFile:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Transcoding audio starts",
+                    extra={
+                        "file": str(exportedFile),
+                        "options": encodeArgs,
+                    },
+                )
+
+            _ffmpeg_transcode(
+                source,
+                exportedFile,
+                encodeArgs,
+                input_format=input_format,
+                input_args=input_args,
+            )
+
+            logger.info(
+                "Transcoding audio completed",
+                extra={"file": str(exportedFile)},
+            )
+
+            self.persister.persist(destination, exportedFile)
+
+    @contextmanager
+    def _temporary_path(self) -> Iterator[Path]:
+        # Unlike NamedTemporaryFile, no descriptor is held open while ffmpeg
+        # (or the loader) writes the file through its path.
+        fd, path = tempfile.mkstemp(dir=self._scratch_dir())
+        os.close(fd)
+
+        try:
+            yield Path(path)
+        finally:
+            Path(path).unlink(missing_ok=True)
+
+    def _scratch_dir(self) -> str | None:
+        # An explicit directory is used as is, the default is picked per file
+        return self.tmp_dir if self.tmp_dir is not None else _default_tmp_dir()
+
+    def _compute_export_args(
+        self,
+        output: Output,
+        destination: AnyUrl | PurePosixPath,
+        source_format: str | None = None,
+    ) -> _ExportArgs:
+        exportOptions = self._resolve_export_options(output, destination)
+
+        if source_format and _can_copy(source_format, exportOptions):
+            self.logger.info(
+                "Copying audio stream without re-encoding",
+                extra={"destination": destination, "format": exportOptions.format},
+            )
+
+            exportOptions = exportOptions.model_copy(update={"codec": "copy"})
+
+        return exportOptions, _encode_args(exportOptions, self.threads)
+
+    def _resolve_export_options(
+        self,
+        output: Output,
+        destination: AnyUrl | PurePosixPath,
+    ) -> ExportOptions:
+        # Defaults need no validation
+        exportOptions = output.export or ExportOptions.model_construct()
+
+        if not exportOptions.format:
+            exportOptions = exportOptions.model_copy(
+                update={"format": _get_extension(destination) or _DEFAULT_FORMAT}
+            )
+
+            self.logger.info(
+                "Detecting output format",
+                extra={
+                    "destination": destination,
+                    "format": exportOptions.format,
+                },
+            )
+
+        return exportOptions
 
     def _export(
         self,
         audio: AudioSegment,
         output: Output,
-        name: str | None = None,
     ):
         exportOptions = output.export
         exportArgs = {}
 
         destination = output.destination
 
-        if name:
-            destination = _append_path(destination, name)
-
         if exportOptions:
             if not exportOptions.format:
                 exportOptions.format = _get_extension(destination)
@@ -223,33 +924,546 @@ class Executor:
 
             exportArgs = exportOptions.model_dump(exclude_none=True)
 
-        with tempfile.NamedTemporaryFile(delete=True) as exportedFile:
-            self.logger.debug(
-                "Exporting audio starts",
-                extra={
-                    "file": exportedFile.name,
-                    "options": exportArgs,
-                },
-            )
+        with self._temporary_path() as exportedFile:
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(
+                    "Exporting audio starts",
+                    extra={
+                        "file": str(exportedFile),
+                        "options": exportArgs,
+                    },
+                )
 
-            audio.export(exportedFile.name, **exportArgs)
+            audio.export(str(exportedFile), **exportArgs)
 
             self.logger.info(
                 "Exporting audio completed",
-                extra={"file": exportedFile.name},
+                extra={"file": str(exportedFile)},
             )
 
-            self.persister.persist(destination, Path(exportedFile.name))
+            self.persister.persist(destination, exportedFile)
+
+
+# Memory-backed filesystem used for temporary files when available
+_SHM_DIR = "/dev/shm"
+
+# Free space below which the memory-backed filesystem is not used
+_SHM_MIN_FREE = 1024 * 1024 * 1024
+
+# Buffer size for pipes to and from ffmpeg
+_PIPE_SIZE = 1024 * 1024
+
+# PCM codecs sources are decoded to, by the sample format of their decoder,
+# so that neither bit depth nor floating point headroom is lost
+_DECODE_CODECS = {
+    "u8": "pcm_u8",
+    "s16": "pcm_s16le",
+    "s32": "pcm_s32le",
+    "s64": "pcm_s32le",
+    "flt": "pcm_f32le",
+    "dbl": "pcm_f64le",
+}
+
+# Raw PCM demuxers by WAV format tag and bits per sample
+_WAV_FORMATS = {
+    (1, 8): "u8",
+    (1, 16): "s16le",
+    (1, 24): "s24le",
+    (1, 32): "s32le",
+    (3, 32): "f32le",
+    (3, 64): "f64le",
+}
+
+# Samples pydub would hold for decoded PCM, which it writes as is for raw and
+# WAV exports: it widens 24 bit samples to 32 bits and decodes lossy (floating
+# point) sources to 16 bits
+_PYDUB_FORMATS = {
+    "u8": "u8",
+    "s16le": "s16le",
+    "s24le": "s32le",
+    "s32le": "s32le",
+    "f32le": "s16le",
+    "f64le": "s16le",
+}
+
+# Codecs pydub picks when none is given (see AudioSegment.DEFAULT_CODECS)
+_DEFAULT_CODECS = {"ogg": "libvorbis"}
+
+# Format pydub exports to when none is given (see AudioSegment.export)
+_DEFAULT_FORMAT = "mp3"
+
+# Output formats (usually file extensions) ffmpeg knows under a different muxer name
+_MUXERS = {"m4a": "ipod", "m4b": "ipod", "aac": "adts", "mka": "matroska"}
+
+# Input formats ffmpeg knows under a different demuxer name
+_FORMAT_ALIASES = {"m4a": "mp4", "wave": "wav"}
+
+# Input formats that ffmpeg can only demux from a seekable file
+_SEEKABLE_FORMATS = {"mp4", "m4a", "m4b", "mov", "3gp"}
+
+# Input formats whose streams can be cut on packet boundaries and remuxed as is
+# (uncompressed sources are cut sample-exact from the decoded PCM instead)
+_COPY_SEGMENT_FORMATS = {"mp3", "aac"}
+
+# Output formats whose muxers write complete files without seeking back
+# (others finalize headers, durations or indexes once encoding is done)
+_STREAMABLE_OUTPUT_FORMATS = {
+    "ogg",
+    "oga",
+    "opus",
+    "spx",
+    "adts",
+    "alaw",
+    "mulaw",
+    "u8",
+    "s8",
+    "s16le",
+    "s16be",
+    "s24le",
+    "s24be",
+    "s32le",
+    "s32be",
+    "f32le",
+    "f32be",
+    "f64le",
+    "f64be",
+}
+
+
+def _default_tmp_dir(reserve: int = 0) -> str | None:
+    if not (os.path.isdir(_SHM_DIR) and os.access(_SHM_DIR, os.W_OK)):
+        return None
+
+    # Files in a tmpfs count against memory: when it is running low (or could
+    # not hold what is reserved on top), fall back to the (disk-backed) system
+    # temporary directory.
+    if shutil.disk_usage(_SHM_DIR).free < _SHM_MIN_FREE + reserve:
+        return None
+
+    return _SHM_DIR
+
+
+def _requires_pydub(options: ExportOptions | None) -> bool:
+    # Raw exports dump pydub's in-memory PCM as is, which has no ffmpeg equivalent
+    return options is not None and options.format == "raw"
+
+
+def _can_stream(input_format: str, options: ExportOptions | None) -> bool:
+    return input_format.lower() not in _SEEKABLE_FORMATS and not _requires_pydub(
+        options
+    )
+
+
+def _can_copy(input_format: str, options: ExportOptions) -> bool:
+    # Remuxing keeps the source codec, so nothing about the encoding may change
+    return (
+        _demuxer(input_format) == _demuxer(options.format or "")
+        and options.codec in (None, "copy")
+        and not options.bitrate
+        and not options.parameters
+    )
+
+
+def _demuxer(format: str) -> str:
+    return _FORMAT_ALIASES.get(format.lower(), format.lower())
+
+
+def _can_stream_output(options: ExportOptions) -> bool:
+    return _muxer(options.format or "") in _STREAMABLE_OUTPUT_FORMATS
+
+
+def _muxer(format: str) -> str:
+    return _MUXERS.get(format.lower(), format.lower())
+
+
+def _encode_args(options: ExportOptions, threads: int = 0) -> tuple[str, ...]:
+    if not options.format:
+        raise ValueError("Export format is required")
+
+    # Options are mutable models: key the cache on a snapshot of their values
+    return _build_encode_args(
+        options.format,
+        options.codec,
+        options.bitrate,
+        tuple(options.parameters) if options.parameters else (),
+        tuple(options.tags.items()) if options.tags else (),
+        options.id3v2_version,
+        threads,
+    )
+
+
+@functools.lru_cache(maxsize=128)
+def _build_encode_args(
+    format: str,
+    codec: str | None,
+    bitrate: str | None,
+    parameters: tuple[str, ...],
+    tags: tuple[tuple[str, str], ...],
+    id3v2_version: str | None,
+    threads: int,
+) -> tuple[str, ...]:
+    # Outputs only carry the requested tags, like pydub's exports: ffmpeg would
+    # copy the source's metadata and chapters otherwise
+    args = ["-vn", "-map_metadata", "-1", "-map_chapters", "-1"]
+
+    # 0 lets ffmpeg pick the number of encoder threads
+    args += ["-threads", f"{threads}"]
+
+    codec = codec or _DEFAULT_CODECS.get(format)
+    if codec:
+        args += ["-c:a", codec]
+
+    if bitrate:
+        args += ["-b:a", bitrate]
+
+    args += parameters
+
+    if tags:
+        for key, value in tags:
+            args += ["-metadata", f"{key}={value}"]
+
+        if format == "mp3":
+            id3v2_version = id3v2_version or "4"
+            if id3v2_version not in ("3", "4"):
+                raise InvalidID3TagVersion(
+                    f"id3v2_version not allowed, allowed versions: {['3', '4']}"
+                )
+
+            args += ["-id3v2_version", id3v2_version]
+
+    args += ["-f", _muxer(format)]
+
+    return tuple(args)
+
+
+def _ffmpeg_input_args(
+    src: Path | Iterable[Buffer],
+    input_format: str | None = None,
+    input_args: Sequence[str] = (),
+) -> list[str]:
+    argv = ["ffmpeg", "-hide_banner", "-y", *input_args]
+
+    if input_format:
+        argv += ["-f", _FORMAT_ALIASES.get(input_format.lower(), input_format)]
+
+    return argv + ["-i", str(src) if isinstance(src, Path) else "pipe:0"]
+
+
+def _ffmpeg_transcode(
+    src: Path | Iterable[Buffer],
+    dst: Path,
+    encode_args: Sequence[str],
+    input_format: str | None = None,
+    input_args: Sequence[str] = (),
+):
+    _run_ffmpeg(
+        [
+            *_ffmpeg_input_args(src, input_format, input_args),
+            *encode_args,
+            str(dst),
+        ],
+        src,
+    )
+
+
+def _ffmpeg_decode(
+    src: Path | Iterable[Buffer],
+    dst: Path,
+    input_format: str | None = None,
+):
+    if isinstance(src, Path):
+        codec = _probe_decode_codec(src, input_format)
+    else:
+        # Probe the beginning of the stream, then decode all of it
+        chunks = iter(src)
+        head = bytearray()
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= _PIPE_SIZE:
+                break
+
+        codec = _probe_decode_codec(bytes(head), input_format)
+        src = itertools.chain([head], chunks)
+
+    _run_ffmpeg(
+        [
+            *_ffmpeg_input_args(src, input_format),
+            # Past 4 GiB, sizes only fit into the 64 bit fields of RF64
+            *["-vn", "-c:a", codec, "-f", "wav", "-rf64", "auto"],
+            str(dst),
+        ],
+        src,
+    )
+
+
+def _probe_decode_codec(src: Path | bytes, input_format: str | None = None) -> str:
+    argv = ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_streams"]
+
+    if input_format:
+        argv += ["-f", _demuxer(input_format)]
+
+    process = subprocess.run(
+        [*argv, "-of", "json", str(src) if isinstance(src, Path) else "pipe:0"],
+        input=None if isinstance(src, Path) else src,
+        check=False,
+        capture_output=True,
+    )
+
+    try:
+        streams = json.loads(process.stdout).get("streams") or [{}]
+    except json.JSONDecodeError:
+        streams = [{}]
+
+    # Planar and packed samples decode to the same PCM
+    sampleFormat = streams[0].get("sample_fmt", "").removesuffix("p")
+
+    # 24 bit sources decode to 32 bit samples, which would waste a byte on each
+    bits = int(streams[0].get("bits_per_raw_sample") or 0)
+    if sampleFormat == "s32" and 0 < bits <= 24:
+        return "pcm_s24le"
+
+    # Floating point samples hold any other sample format without loss
+    return _DECODE_CODECS.get(sampleFormat, "pcm_f32le")
+
+
+def _ffmpeg_stream(
+    src: Path | Iterable[Buffer],
+    encode_args: Sequence[str],
+    input_format: str | None = None,
+    input_args: Sequence[str] = (),
+) -> Iterator[bytes]:
+    yield from _ffmpeg_process(
+        [
+            *_ffmpeg_input_args(src, input_format, input_args),
+            *encode_args,
+            "pipe:1",
+        ],
+        src,
+        capture_output=True,
+    )
+
+
+def _chunks(view: memoryview, size: int = _PIPE_SIZE) -> Iterator[memoryview]:
+    for i in range(0, len(view), size):
+        yield view[i : i + size]
+
+
+def _run_ffmpeg(argv: list[str], src: Path | Iterable[Buffer]):
+    for _ in _ffmpeg_process(argv, src):
+        pass
+
+
+def _ffmpeg_process(
+    argv: list[str],
+    src: Path | Iterable[Buffer],
+    capture_output: bool = False,
+) -> Iterator[bytes]:
+    """Run ffmpeg, feeding it the source on stdin when it is not a local file.
+
+    Yields the encoded output when capture_output is set.
+    """
+
+    streaming = not isinstance(src, Path)
+
+    process = subprocess.Popen(
+        argv,
+        bufsize=_PIPE_SIZE,
+        stdin=subprocess.PIPE if streaming else subprocess.DEVNULL,
+        stdout=subprocess.PIPE if capture_output else subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+
+    for pipe in (process.stdin, process.stdout):
+        if pipe:
+            _grow_pipe(pipe.fileno())
+
+    errors: list[Exception] = []
+    stderr = bytearray()
+
+    def drain():
+        assert process.stderr is not None
+
+        stderr.extend(process.stderr.read())
+
+    def feed():
+        assert process.stdin is not None
+        assert not isinstance(src, Path)
+
+        try:
+            for chunk in src:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg exited early, its return code tells why
+        except Exception as e:
+            errors.append(e)
 
+            # Do not let ffmpeg finish encoding a truncated source
+            process.kill()
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
 
-def _get_extension(ref: AnyUrl | PurePosixPath) -> str:
+    threads = [threading.Thread(target=drain, daemon=True)]
+    if streaming:
+        threads.append(threading.Thread(target=feed, daemon=True))
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        if capture_output:
+            assert process.stdout is not None
+
+            # Unlike the buffered reader, which waits for a full buffer,
+            # a raw read hands over whatever ffmpeg has written so far.
+            fd = process.stdout.fileno()
+
+            yield from iter(lambda: os.read(fd, _PIPE_SIZE), b"")
+
+        process.wait()
+    finally:
+        # The consumer may stop early (eg. a failed upload)
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+    if process.returncode != 0:
+        raise _encoding_error(process.returncode, bytes(stderr))
+
+
+def _grow_pipe(fd: int):
+    # Linux pipes hold 64 KiB by default, so ffmpeg would block (and each
+    # side would make a syscall) every 64 KiB. Larger pipes may be refused
+    # by the system limit, in which case the default is kept.
+    if not hasattr(fcntl, "F_SETPIPE_SZ"):
+        return
+
+    try:
+        fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, _PIPE_SIZE)
+    except OSError:
+        pass
+
+
+@dataclass
+class _WavHeader:
+    offset: int
+    size: int
+    rate: int
+    channels: int
+    format: str
+    frame_size: int
+
+
+def _read_wav_header(file: BinaryIO) -> _WavHeader:
+    """Read the header of a WAV file, up to the start of its samples.
+
+    Unlike the wave module, this supports floating point samples too.
+    """
+
+    riff = file.read(12)
+    if len(riff) < 12 or riff[:4] not in (b"RIFF", b"RF64") or riff[8:] != b"WAVE":
+        raise CouldntDecodeError("Not a WAV file")
+
+    fmt: tuple[int, int, int, int] | None = None
+    dataSize: int | None = None
+
+    while True:
+        chunk = file.read(8)
+        if len(chunk) < 8:
+            raise CouldntDecodeError("No data chunk in WAV file")
+
+        id, size = chunk[:4], int.from_bytes(chunk[4:], "little")
+
+        if id == b"data":
+            break
+
+        data = file.read(size + size % 2)
+
+        # RF64 keeps the actual data size in its ds64 chunk
+        if id == b"ds64":
+            (dataSize,) = struct.unpack_from("<Q", data, 8)
+        elif id == b"fmt ":
+            tag, channels, rate = struct.unpack_from("<HHI", data)
+            (bits,) = struct.unpack_from("<H", data, 14)
+
+            # WAVE_FORMAT_EXTENSIBLE: the actual tag leads the sub format GUID
+            if tag == 0xFFFE:
+                (tag,) = struct.unpack_from("<H", data, 24)
+
+            fmt = (tag, channels, rate, bits)
+
+    if fmt is None:
+        raise CouldntDecodeError("No format chunk in WAV file")
+
+    tag, channels, rate, bits = fmt
+
+    format = _WAV_FORMATS.get((tag, bits))
+    if not format:
+        raise CouldntDecodeError(
+            f"Unsupported WAV sample format: tag {tag}, {bits} bits per sample"
+        )
+
+    if size == 0xFFFFFFFF and dataSize is not None:
+        size = dataSize
+
+    offset = file.tell()
+    available = os.fstat(file.fileno()).st_size - offset
+
+    return _WavHeader(
+        offset=offset,
+        # The size may be a placeholder when the file was not finalized (or did
+        # not fit into 32 bits): then the samples run up to the end of the file
+        size=available if size == 0xFFFFFFFF else min(size, available),
+        rate=rate,
+        channels=channels,
+        format=format,
+        frame_size=channels * bits // 8,
+    )
+
+
+def _encoding_error(returncode: int, stderr: bytes) -> CouldntEncodeError:
+    return CouldntEncodeError(
+        f"Encoding failed. ffmpeg returned error code: {returncode}\n\n"
+        f"Output from ffmpeg:\n\n{stderr.decode(errors='replace')}"
+    )
+
+
+def _get_extension(ref: AnyUrl | PurePosixPath | str) -> str:
+    if isinstance(ref, AnyUrl):
+        if not ref.path:
+            raise ValueError("Cannot determine format from empty path")
+
+        ref = ref.path
+
+    # Same as PurePosixPath(ref).suffix without building a path object
+    stem, _, extension = str(ref).rsplit("/", 1)[-1].rpartition(".")
+
+    return extension if stem else ""
+
+
+def _append_paths(
+    ref: AnyUrl | PurePosixPath,
+    names: Sequence[str],
+) -> list[AnyUrl | PurePosixPath]:
     if isinstance(ref, PurePosixPath):
-        return ref.suffix.lstrip(".")
+        return [ref / name for name in names]
+
+    # Names go into the path, in front of any query or fragment
+    if ref.query or ref.fragment:
+        return [_append_path(ref, name) for name in names]
 
-    if not ref.path:
-        raise ValueError("Cannot determine format from empty path")
+    # Plain string concatenation spares rebuilding the URL from its parts
+    base = str(ref).rstrip("/")
 
-    return PurePosixPath(ref.path).suffix.lstrip(".")
+    return [type(ref)(f"{base}/{name}") for name in names]
 
 
 def _append_path(ref: AnyUrl | PurePosixPath, name: str) -> AnyUrl | PurePosixPath:
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import tempfile
+from collections.abc import Iterable, Iterator, Sequence
+from pathlib import Path, PurePosixPath
+from typing import TYPE_CHECKING
+from urllib.parse import unquote
+
+import obstore
+from pydantic import AnyUrl
+
+from .executor import Loader, Persister
+
+if TYPE_CHECKING:
+    from obstore.store import ClientConfig, ObjectStore
+
+
+class _StoreResolver:
+    def __init__(
+        self,
+        store: ObjectStore | None = None,
+        client_options: ClientConfig | None = None,
+    ):
+        self.store = store
+        self.client_options = client_options
+
+        self._stores: dict[str, ObjectStore] = {}
+
+    def _can_resolve(self, ref: AnyUrl | PurePosixPath) -> bool:
+        return not isinstance(ref, PurePosixPath) or self.store is not None
+
+    def _resolve(self, ref: AnyUrl | PurePosixPath) -> tuple[ObjectStore, str]:
+        if isinstance(ref, PurePosixPath):
+            if self.store is None:
+                raise ValueError("Cannot resolve path without a configured store")
+
+            return self.store, str(ref).lstrip("/")
+
+        if not ref.path:
+            raise ValueError("Cannot resolve URL with empty path")
+
+        base = f"{ref.scheme}://{ref.host or ''}"
+
+        store = self._stores.get(base)
+        if store is None:
+            store = obstore.store.from_url(
+                base if ref.host else f"{base}/",
+                client_options=self.client_options,
+            )
+            self._stores[base] = store
+
+        # URL paths are percent-encoded, object keys are not
+        return store, unquote(ref.path).lstrip("/")
+
+
+class StreamLoader(_StoreResolver):
+    """Loader that can also stream objects straight from an object store.
+
+    Loading to a file (and streaming paths without a configured store) is
+    delegated to the wrapped loader.
+    """
+
+    def __init__(
+        self,
+        loader: Loader,
+        store: ObjectStore | None = None,
+        client_options: ClientConfig | None = None,
+        chunk_size: int = 1024 * 1024,
+        max_concurrency: int = 64,
+    ):
+        super().__init__(store, client_options)
+
+        self.loader = loader
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+
+    def load(self, ref: AnyUrl | PurePosixPath, dst: Path):
+        self.loader.load(ref, dst)
+
+    def stream(self, ref: AnyUrl | PurePosixPath) -> Iterator[bytes]:
+        if not self._can_resolve(ref):
+            yield from self._stream_loaded(ref)
+
+            return
+
+        store, path = self._resolve(ref)
+
+        result = obstore.get(store, path)
+
+        for chunk in result.stream(min_chunk_size=self.chunk_size):
+            yield bytes(chunk)
+
+    def _stream_loaded(self, ref: AnyUrl | PurePosixPath) -> Iterator[bytes]:
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+
+        try:
+            self.loader.load(ref, Path(path))
+
+            with open(path, "rb") as file:
+                yield from iter(lambda: file.read(self.chunk_size), b"")
+        finally:
+            Path(path).unlink(missing_ok=True)
+
+    def load_many(
+        self,
+        refs: Sequence[AnyUrl | PurePosixPath],
+        dsts: Sequence[Path],
+    ):
+        asyncio.run(self._load_many(refs, dsts))
+
+    async def _load_many(
+        self,
+        refs: Sequence[AnyUrl | PurePosixPath],
+        dsts: Sequence[Path],
+    ):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def load(ref: AnyUrl | PurePosixPath, dst: Path):
+            if not self._can_resolve(ref):
+                async with semaphore:
+                    await asyncio.to_thread(self.loader.load, ref, dst)
+
+                return
+
+            store, path = self._resolve(ref)
+
+            async with semaphore:
+                result = await obstore.get_async(store, path)
+
+                with open(dst, "wb") as file:
+                    async for chunk in result.stream(min_chunk_size=self.chunk_size):
+                        file.write(chunk)
+
+        await asyncio.gather(
+            *(load(ref, dst) for ref, dst in zip(refs, dsts, strict=True))
+        )
+
+
+class StreamPersister(_StoreResolver):
+    """Persister that uploads to an object store in parallel parts.
+
+    Files larger than chunk_size and streams of bytes are uploaded in multiple
+    parts, up to max_concurrency at a time. Paths without a configured store
+    are delegated to the wrapped persister.
+    """
+
+    def __init__(
+        self,
+        persister: Persister,
+        store: ObjectStore | None = None,
+        client_options: ClientConfig | None = None,
+        chunk_size: int = 8 * 1024 * 1024,
+        max_concurrency: int = 16,
+    ):
+        super().__init__(store, client_options)
+
+        self.persister = persister
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+
+    def persist(self, ref: AnyUrl | PurePosixPath, src: Path):
+        if not self._can_resolve(ref):
+            self.persister.persist(ref, src)
+
+            return
+
+        store, path = self._resolve(ref)
+
+        obstore.put(
+            store,
+            path,
+            src,
+            chunk_size=self.chunk_size,
+            max_concurrency=self.max_concurrency,
+        )
+
+    def persist_stream(self, ref: AnyUrl | PurePosixPath, chunks: Iterable[bytes]):
+        if not self._can_resolve(ref):
+            self._persist_buffered(ref, chunks)
+
+            return
+
+        store, path = self._resolve(ref)
+
+        # Iterables are always uploaded in multiple parts
+        obstore.put(
+            store,
+            path,
+            chunks,
+            chunk_size=self.chunk_size,
+            max_concurrency=self.max_concurrency,
+        )
+
+    def _persist_buffered(
+        self,
+        ref: AnyUrl | PurePosixPath,
+        chunks: Iterable[bytes],
+    ):
+        fd, path = tempfile.mkstemp()
+
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in chunks:
+                    file.write(chunk)
+
+            self.persister.persist(ref, Path(path))
+        finally:
+            Path(path).unlink(missing_ok=True)
@@ -1,6 +1,7 @@
 import restate
 
 from .executor import (
+    BatchExportRequest,
     Executor,
     ExportRequest,
     SegmentRequest,
@@ -35,6 +36,19 @@ def register_service(
             request=request,
         )
 
+    @service.handler()
+    async def batch_export(
+        ctx: restate.Context,
+        request: BatchExportRequest,
+    ):
+        """Export a batch of audio files."""
+
+        return await ctx.run_typed(
+            "batch_export",
+            executor.batch_export,
+            request=request,
+        )
+
     @service.handler()
     async def segment(
         ctx: restate.Context,
@@ -0,0 +1,370 @@
+import struct
+import threading
+import time
+import wave
+from pathlib import Path, PurePosixPath
+
+import pytest
+from pydantic import AnyUrl
+from pydub.exceptions import CouldntDecodeError
+
+from restate_pydub.executor import (
+    DecodedCache,
+    Executor,
+    ExportOptions,
+    Output,
+    Segment,
+    _append_paths,
+    _can_copy,
+    _get_extension,
+    _read_wav_header,
+)
+
+
+def _wav(
+    path: Path,
+    fmt: bytes,
+    data: bytes,
+    data_size: int | None = None,
+    chunks: bytes = b"",
+    riff: bytes = b"RIFF",
+) -> Path:
+    body = b"WAVE" + _chunk(b"fmt ", fmt) + chunks
+    body += b"data" + struct.pack("<I", len(data) if data_size is None else data_size)
+
+    path.write_bytes(riff + struct.pack("<I", len(body) + len(data)) + body + data)
+
+    return path
+
+
+def _chunk(id: bytes, data: bytes) -> bytes:
+    return id + struct.pack("<I", len(data)) + data + b"\0" * (len(data) % 2)
+
+
+def _fmt(tag: int, channels: int, rate: int, bits: int) -> bytes:
+    frameSize = channels * bits // 8
+
+    return struct.pack(
+        "<HHIIHH", tag, channels, rate, rate * frameSize, frameSize, bits
+    )
+
+
+class TestReadWavHeader:
+    def test_pcm(self, tmp_path: Path):
+        path = tmp_path / "a.wav"
+
+        with wave.open(str(path), "wb") as file:
+            file.setnchannels(2)
+            file.setsampwidth(2)
+            file.setframerate(44100)
+            file.writeframes(b"\1\2\3\4" * 100)
+
+        with open(path, "rb") as file:
+            header = _read_wav_header(file)
+
+        assert header.offset == 44
+        assert header.size == 400
+        assert header.rate == 44100
+        assert header.channels == 2
+        assert header.format == "s16le"
+        assert header.frame_size == 4
+
+    def test_extensible_float(self, tmp_path: Path):
+        # WAVE_FORMAT_EXTENSIBLE with a WAVE_FORMAT_IEEE_FLOAT sub format
+        fmt = _fmt(0xFFFE, 1, 48000, 32) + struct.pack("<HHIH", 22, 32, 4, 3)
+        fmt += b"\0\0\0\0\x10\0\x80\0\0\xaa\0\x38\x9b\x71"
+
+        path = _wav(tmp_path / "a.wav", fmt, b"\0" * 64)
+
+        with open(path, "rb") as file:
+            header = _read_wav_header(file)
+
+        assert header.format == "f32le"
+        assert header.frame_size == 4
+        assert header.size == 64
+
+    def test_skips_other_chunks(self, tmp_path: Path):
+        path = _wav(
+            tmp_path / "a.wav",
+            _fmt(1, 1, 8000, 8),
+            b"\x80" * 10,
+            chunks=_chunk(b"LIST", b"odd"),
+        )
+
+        with open(path, "rb") as file:
+            header = _read_wav_header(file)
+
+        assert header.format == "u8"
+        assert header.offset == path.stat().st_size - 10
+        assert header.size == 10
+
+    def test_rf64(self, tmp_path: Path):
+        # The ds64 chunk holds the sizes: RIFF, data and sample count
+        ds64 = _chunk(b"ds64", struct.pack("<QQQI", 0, 24, 8, 0))
+
+        path = _wav(
+            tmp_path / "a.wav",
+            _fmt(1, 1, 8000, 24),
+            b"\0" * 30,
+            data_size=0xFFFFFFFF,
+            chunks=ds64,
+            riff=b"RF64",
+        )
+
+        with open(path, "rb") as file:
+            header = _read_wav_header(file)
+
+        assert header.format == "s24le"
+        assert header.size == 24
+
+    def test_size_placeholder(self, tmp_path: Path):
+        path = _wav(
+            tmp_path / "a.wav",
+            _fmt(1, 1, 8000, 16),
+            b"\0" * 30,
+            data_size=0xFFFFFFFF,
+        )
+
+        with open(path, "rb") as file:
+            header = _read_wav_header(file)
+
+        assert header.size == 30
+
+    def test_truncated(self, tmp_path: Path):
+        path = _wav(tmp_path / "a.wav", _fmt(1, 1, 8000, 16), b"\0" * 30, data_size=100)
+
+        with open(path, "rb") as file:
+            header = _read_wav_header(file)
+
+        assert header.size == 30
+
+    def test_not_a_wav(self, tmp_path: Path):
+        path = tmp_path / "a.wav"
+        path.write_bytes(b"ID3\x04" + b"\0" * 100)
+
+        with open(path, "rb") as file, pytest.raises(CouldntDecodeError):
+            _read_wav_header(file)
+
+    def test_unsupported_format(self, tmp_path: Path):
+        # IMA ADPCM
+        path = _wav(tmp_path / "a.wav", _fmt(0x11, 1, 8000, 4), b"\0" * 30)
+
+        with open(path, "rb") as file, pytest.raises(CouldntDecodeError):
+            _read_wav_header(file)
+
+
+class TestDecodedCache:
+    def test_hit(self, tmp_path: Path):
+        cache = DecodedCache(1024, dir=str(tmp_path))
+        decodes: list[Path] = []
+
+        def decode(dst: Path):
+            decodes.append(dst)
+            dst.write_bytes(b"decoded")
+
+        for _ in range(2):
+            with cache.acquire(PurePosixPath("a.mp3"), decode) as path:
+                assert path.read_bytes() == b"decoded"
+
+        assert len(decodes) == 1
+
+    def test_shares_decode_in_progress(self, tmp_path: Path):
+        cache = DecodedCache(1024, dir=str(tmp_path))
+        decodes: list[Path] = []
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def decode(dst: Path):
+            decodes.append(dst)
+            started.set()
+
+            assert release.wait(5)
+            dst.write_bytes(b"decoded")
+
+        results: list[bytes] = []
+
+        def acquire():
+            with cache.acquire(PurePosixPath("a.mp3"), decode) as path:
+                results.append(path.read_bytes())
+
+        threads = [threading.Thread(target=acquire) for _ in range(4)]
+        threads[0].start()
+        assert started.wait(5)
+
+        for thread in threads[1:]:
+            thread.start()
+
+        # Let the others find the decode in progress
+        time.sleep(0.1)
+        release.set()
+
+        for thread in threads:
+            thread.join(5)
+
+        assert len(decodes) == 1
+        assert results == [b"decoded"] * 4
+
+    def test_failed_decode_is_retried(self, tmp_path: Path):
+        cache = DecodedCache(1024, dir=str(tmp_path))
+
+        def fail(dst: Path):
+            dst.write_bytes(b"partial")
+
+            raise RuntimeError("boom")
+
+        with (
+            pytest.raises(RuntimeError),
+            cache.acquire(PurePosixPath("a.mp3"), fail),
+        ):
+            pass
+
+        assert list(cache.dir.iterdir()) == []
+
+        def decode(dst: Path):
+            dst.write_bytes(b"decoded")
+
+        with cache.acquire(PurePosixPath("a.mp3"), decode) as path:
+            assert path.read_bytes() == b"decoded"
+
+    def test_evicts_least_recently_used(self, tmp_path: Path):
+        cache = DecodedCache(20, dir=str(tmp_path))
+
+        def decode(dst: Path):
+            dst.write_bytes(b"0123456789")
+
+        paths: dict[str, Path] = {}
+
+        for name in ("a", "b", "a", "c"):
+            with cache.acquire(PurePosixPath(name), decode) as path:
+                paths[name] = path
+
+        # b was used least recently when c pushed the cache over its size
+        assert paths["a"].exists()
+        assert not paths["b"].exists()
+        assert paths["c"].exists()
+
+    def test_keeps_entries_in_use(self, tmp_path: Path):
+        cache = DecodedCache(5, dir=str(tmp_path))
+
+        def decode(dst: Path):
+            dst.write_bytes(b"0123456789")
+
+        with cache.acquire(PurePosixPath("a"), decode) as a:
+            with cache.acquire(PurePosixPath("b"), decode) as b:
+                assert a.exists()
+                assert b.exists()
+
+            assert not b.exists()
+            assert a.exists()
+
+        assert not a.exists()
+
+
+@pytest.mark.parametrize(
+    ("ref", "extension"),
+    [
+        ("audio.mp3", "mp3"),
+        ("dir/audio.tar.gz", "gz"),
+        ("dir.d/audio", ""),
+        (".hidden", ""),
+        (PurePosixPath("dir/audio.WAV"), "WAV"),
+        (AnyUrl("s3://bucket/audio.ogg?version=1.2"), "ogg"),
+        (AnyUrl("file:///audio%20file.flac"), "flac"),
+    ],
+)
+def test_get_extension(ref: AnyUrl | PurePosixPath | str, extension: str):
+    assert _get_extension(ref) == extension
+
+
+def test_get_extension_empty_url_path():
+    with pytest.raises(ValueError):
+        _get_extension(AnyUrl("s3://bucket"))
+
+
+class TestAppendPaths:
+    def test_path(self):
+        assert _append_paths(PurePosixPath("out/segments"), ["a.mp3", "b.mp3"]) == [
+            PurePosixPath("out/segments/a.mp3"),
+            PurePosixPath("out/segments/b.mp3"),
+        ]
+
+    @pytest.mark.parametrize("base", ["s3://bucket/segments", "s3://bucket/segments/"])
+    def test_url(self, base: str):
+        urls = _append_paths(AnyUrl(base), ["a.mp3", "b c.mp3"])
+
+        assert [str(url) for url in urls] == [
+            "s3://bucket/segments/a.mp3",
+            "s3://bucket/segments/b%20c.mp3",
+        ]
+        assert all(isinstance(url, AnyUrl) for url in urls)
+
+    def test_url_without_path(self):
+        urls = _append_paths(AnyUrl("s3://bucket"), ["a.mp3"])
+
+        assert [str(url) for url in urls] == ["s3://bucket/a.mp3"]
+
+    def test_url_with_query(self):
+        urls = _append_paths(AnyUrl("https://host/segments?sig=1#part"), ["a.mp3"])
+
+        assert [str(url) for url in urls] == ["https://host/segments/a.mp3?sig=1#part"]
+
+
+@pytest.mark.parametrize(
+    ("input_format", "options", "expected"),
+    [
+        ("mp3", ExportOptions(format="mp3"), True),
+        ("MP3", ExportOptions(format="mp3"), True),
+        ("m4a", ExportOptions(format="mp4"), True),
+        ("wav", ExportOptions(format="wave"), True),
+        ("mp3", ExportOptions(format="mp3", codec="copy"), True),
+        ("mp3", ExportOptions(format="ogg"), False),
+        ("mp3", ExportOptions(format="mp3", codec="libmp3lame"), False),
+        ("mp3", ExportOptions(format="mp3", bitrate="64k"), False),
+        ("mp3", ExportOptions(format="mp3", parameters=["-ac", "1"]), False),
+    ],
+)
+def test_can_copy(input_format: str, options: ExportOptions, expected: bool):
+    assert _can_copy(input_format, options) is expected
+
+
+class TestCanCopySegments:
+    @pytest.fixture
+    def executor(self) -> Executor:
+        return Executor(loader=None, persister=None)  # pyright: ignore[reportArgumentType]
+
+    @staticmethod
+    def _segments(*names: str) -> list[Segment]:
+        return [Segment(start=0, end=1, name=name) for name in names]
+
+    @pytest.mark.parametrize(
+        ("format", "names", "export", "expected"),
+        [
+            ("mp3", ["a.mp3", "b.mp3"], None, True),
+            ("aac", ["a.mp3"], ExportOptions(format="aac"), True),
+            ("mp3", ["a", "b"], None, True),
+            ("mp3", ["a.mp3", "b.ogg"], None, False),
+            ("mp3", ["a.mp3"], ExportOptions(bitrate="64k"), False),
+            ("mp3", ["a.raw"], ExportOptions(format="raw"), False),
+            # Copied stream headers would describe the whole source
+            ("flac", ["a.flac"], None, False),
+            ("ogg", ["a.ogg"], None, False),
+            ("m4a", ["a.m4a"], None, False),
+            # Uncompressed sources are cut from the decoded PCM
+            ("wav", ["a.wav"], None, False),
+        ],
+    )
+    def test_can_copy_segments(
+        self,
+        executor: Executor,
+        format: str,
+        names: list[str],
+        export: ExportOptions | None,
+        expected: bool,
+    ):
+        output = Output(destination=PurePosixPath("out"), export=export)
+
+        assert (
+            executor._can_copy_segments(format, self._segments(*names), output)
+            is expected
+        )